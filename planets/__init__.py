@@ -1 +1,9 @@
-from planets.planets import Coordinate, Planet, PlanetSize, Planets, Player, Tableau
+from planets.planets import (
+    Coordinate,
+    Planet,
+    PlacementFailure,
+    PlanetSize,
+    Planets,
+    Player,
+    Tableau,
+)
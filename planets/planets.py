@@ -1,15 +1,31 @@
 from dataclasses import dataclass
 import random
 from enum import Enum
-from typing import Self, Optional
-from math import floor
-from reactivex import Observable, Observer, Subject
-from reactivex.subject import ReplaySubject, BehaviorSubject
-from uuid import uuid4
-from reactivex import abc
+from typing import Self, Optional, Sequence, TYPE_CHECKING
+from itertools import count
+from math import pi
 
+if TYPE_CHECKING:
+    # reactivex is imported on first subscribe, games that never subscribe don't load it
+    from reactivex import abc
 
-@dataclass
+# Source of planet ids, only needs to be unique within the process
+_planet_ids = count()
+
+# Number of random coordinates tried before giving up on placing a planet
+MAX_PLACEMENT_ATTEMPTS = 10_000
+
+# Density of the tightest packing of equal circles in the plane (hexagonal packing)
+_HEX_PACKING_DENSITY = 0.9069
+
+
+class PlacementFailure(RuntimeError):
+    """
+    Raised when a planet can't be placed far enough away from the other planets.
+    """
+
+
+@dataclass(slots=True)
 class Coordinate:
     """
     A class for keeping track of coordinates within the game.
@@ -60,68 +76,200 @@ class PlanetSize(Enum):
     LARGE = 100
 
 
-def check_planet_size(planet_size: PlanetSize | list[PlanetSize]):
-    if isinstance(planet_size, list) and not all(
+# Default for picking any planet size, a tuple so it can't be mutated between calls
+_ALL_SIZES = tuple(PlanetSize)
+
+
+def check_planet_size(planet_size: PlanetSize | Sequence[PlanetSize]):
+    if planet_size is _ALL_SIZES:
+        return
+
+    if isinstance(planet_size, (list, tuple)) and not all(
         isinstance(p, PlanetSize) for p in planet_size
     ):
         raise ValueError(
-            "Invalid planet size. If using a list for planet_size all values must a PlanetSize enum."
+            "Invalid planet size. If using a list or tuple for planet_size all values must be a PlanetSize enum."
         )
 
-    if not (isinstance(planet_size, list)) and not isinstance(planet_size, PlanetSize):
+    if not isinstance(planet_size, (list, tuple)) and not isinstance(
+        planet_size, PlanetSize
+    ):
         raise ValueError("Invalid planet size. Must be a valid PlanetSize enum value.")
 
 
-def create_random_planet(
+def check_planet_count(
     area: Area,
     min_distance: int,
-    planet_size: PlanetSize | list[PlanetSize] = list(PlanetSize),
-    collision_list: list["Planet"] = [],
-    home_player: Optional["Player"] = None,
-    scheduler: abc.SchedulerBase = None,
+    planet_counts: Sequence[tuple[int, PlanetSize | Sequence[PlanetSize]]],
 ):
     """
-    Create random planet within the given area.
+    Make sure the requested planets can reasonably fit in the area.  planet_counts pairs
+    a number of planets with the size or sizes they may have.  Planet centres are kept
+    half a planet away from the edges and must be min_distance apart, so each one claims a
+    circle of diameter min_distance within the area left by its own margin.  Together the
+    groups may use at most half of what a hexagonal packing of those circles allows,
+    beyond that random placement takes too long.
     """
-    check_planet_size(planet_size)
+    load = 0.0
 
-    planet = None
+    for number_of_planets, planet_size in planet_counts:
+        if number_of_planets <= 0:
+            continue
 
-    if isinstance(planet_size, list):
-        planet_size = random.choice(planet_size)
+        if isinstance(planet_size, PlanetSize):
+            planet_size = (planet_size,)
+
+        # Use the largest margin so the check holds whatever sizes are picked
+        largest = max(planet_size, key=lambda size: size.value)
+        margin = largest.value // 2
+        width = area.bottom_right.x - area.upper_left.x - 2 * margin + 1
+        height = area.bottom_right.y - area.upper_left.y - 2 * margin + 1
+
+        if width <= 0 or height <= 0:
+            raise ValueError(f"Invalid area. No room for a {largest.name} planet.")
 
-    while planet is None or check_for_collision(planet, collision_list, min_distance):
-        # Create a planet with random coordinates
-        coordinate = Coordinate(
-            random.randint(
-                area.upper_left.x + floor(planet_size.value / 2),
-                area.bottom_right.x - floor(planet_size.value / 2),
-            ),
-            random.randint(
-                area.upper_left.y + floor(planet_size.value / 2),
-                area.bottom_right.y - floor(planet_size.value / 2),
-            ),
+        if min_distance > 0:
+            max_planets = (
+                _HEX_PACKING_DENSITY * width * height / (pi * (min_distance / 2) ** 2)
+            )
+            load += number_of_planets / max_planets
+
+    if load > 0.5:
+        raise ValueError(
+            f"Too many planets for the area with a min_distance of {min_distance}. "
+            f"Random placement is only reliable while the planets use at most half of "
+            f"what a hexagonal packing allows, these would use {load:.0%}."
+        )
+
+
+class CollisionGrid(object):
+    """
+    A uniform grid of buckets for finding nearby planets.  When the cells are at least
+    min_distance wide, a collision check only has to look at the 3x3 cells around a
+    point.  Each cell keeps the coordinates of its planets in two parallel lists of plain
+    ints.
+    """
+
+    def __init__(self: Self, cell_size: int):
+        self.cell_size = max(cell_size, 1)
+        self.cells: dict[tuple[int, int], tuple[list[int], list[int]]] = {}
+
+    def insert(self: Self, x: int, y: int) -> None:
+        """
+        Insert the coordinates of a planet into the grid.
+        """
+        key = (x // self.cell_size, y // self.cell_size)
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.cells[key] = ([], [])
+
+        cell[0].append(x)
+        cell[1].append(y)
+
+    def collides(self: Self, x: int, y: int, min_distance: int) -> bool:
+        """
+        Check if (x, y) is closer than min_distance to any of the stored coordinates.
+        Only the cells within min_distance of (x, y) are looked at.
+        """
+        cell_size = self.cell_size
+        cells = self.cells
+        cell_x, cell_y = x // cell_size, y // cell_size
+        reach = -(-min_distance // cell_size)
+        min_d2 = min_distance * min_distance
+
+        for key_x in range(cell_x - reach, cell_x + reach + 1):
+            for key_y in range(cell_y - reach, cell_y + reach + 1):
+                cell = cells.get((key_x, key_y))
+                if cell is None:
+                    continue
+
+                # The distance test is inlined to avoid a function call per cell
+                xs, ys = cell
+                for other_x, other_y in zip(xs, ys):
+                    dx = other_x - x
+                    dy = other_y - y
+                    if dx * dx + dy * dy < min_d2:
+                        return True
+
+        return False
+
+
+def _sample_xy(
+    grid: Optional[CollisionGrid],
+    x_low: int,
+    x_high: int,
+    y_low: int,
+    y_high: int,
+    min_distance: int,
+    max_attempts: int,
+) -> tuple[int, int]:
+    """
+    Draw random coordinates within the given bounds until they are at least min_distance
+    away from every coordinate stored in the grid.  Raises PlacementFailure if none are
+    found within max_attempts tries.
+    """
+    # Scaling random() directly is uniform like randint() but skips its Python level
+    # argument handling, which dominates once the board is crowded.
+    rand = random.random
+    x_span = x_high - x_low + 1
+    y_span = y_high - y_low + 1
+
+    # randint() used to reject an empty range, the scaled random() would not
+    if x_span <= 0 or y_span <= 0:
+        raise ValueError(
+            f"Invalid area. No room for a planet between x={x_low}..{x_high} and "
+            f"y={y_low}..{y_high}."
         )
 
-        planet = Planet(coordinate, planet_size, home_player, scheduler=scheduler)
+    for _ in range(max_attempts):
+        x = x_low + int(rand() * x_span)
+        y = y_low + int(rand() * y_span)
+        if grid is None or not grid.collides(x, y, min_distance):
+            return x, y
 
-    return planet
+    raise PlacementFailure(
+        f"Could not place a planet at least {min_distance} away from the other planets "
+        f"after {max_attempts} attempts."
+    )
 
 
-def check_for_collision(
-    planet: "Planet", collision_list: list["Planet"], min_distance: int
+def create_random_planet(
+    area: Area,
+    min_distance: int,
+    planet_size: PlanetSize | Sequence[PlanetSize] = _ALL_SIZES,
+    grid: Optional[CollisionGrid] = None,
+    home_player: Optional["Player"] = None,
+    scheduler: "abc.SchedulerBase" = None,
+    max_attempts: Optional[int] = None,
 ):
     """
-    Check if the planet collides with any other planet in the list.
+    Create random planet within the given area.  If a collision grid is given, the planet
+    will be placed at least min_distance away from every planet stored in it.  Raises
+    PlacementFailure if no free spot is found within max_attempts tries, which defaults to
+    MAX_PLACEMENT_ATTEMPTS.
     """
+    check_planet_size(planet_size)
+
+    if max_attempts is None:
+        max_attempts = MAX_PLACEMENT_ATTEMPTS
+
+    if isinstance(planet_size, (list, tuple)):
+        planet_size = random.choice(planet_size)
 
-    for other_planet in collision_list:
-        if (planet.coordinate.x - other_planet.coordinate.x) ** 2 + (
-            planet.coordinate.y - other_planet.coordinate.y
-        ) ** 2 < min_distance**2:
-            return True
+    half_size = planet_size.value // 2
 
-    return False
+    # Only the accepted coordinates are turned into a planet
+    x, y = _sample_xy(
+        grid,
+        area.upper_left.x + half_size,
+        area.bottom_right.x - half_size,
+        area.upper_left.y + half_size,
+        area.bottom_right.y - half_size,
+        min_distance,
+        max_attempts,
+    )
+
+    return Planet(Coordinate(x, y), planet_size, home_player, scheduler=scheduler)
 
 
 class Player(object):
@@ -129,9 +277,12 @@ class Player(object):
     A class representing a player in the game.
     """
 
+    __slots__ = ("name", "color", "home_planet")
+
     def __init__(self: Self, name: str, color: tuple[int, int, int]):
         self.name = name
         self.color = color
+        self.home_planet = None
 
     def set_home_planet(self: Self, planet: "Planet"):
         """
@@ -148,6 +299,16 @@ class Planet(object):
     A class representing a planet in the game.
     """
 
+    __slots__ = (
+        "coordinate",
+        "planet_size",
+        "home_player",
+        "owner",
+        "id",
+        "scheduler",
+        "planet_observable",
+    )
+
     def __str__(self: Self):
         if self.home_player:
             return f"Planet(id={self.id}, coordinate={self.coordinate}, planet_size={self.planet_size}, home_player={self.home_player.name}))"
@@ -159,15 +320,11 @@ class Planet(object):
         coordinate: Coordinate,
         planet_size: PlanetSize,
         home_player: Optional[Player] = None,
-        scheduler: abc.SchedulerBase = None,
+        scheduler: "abc.SchedulerBase" = None,
+        planet_id: Optional[int] = None,
     ):
-        if not isinstance(planet_size, PlanetSize):
-            raise ValueError(
-                "Invalid planet size. Must be a valid PlanetSize enum value."
-            )
-
         self.coordinate = coordinate
-        self.id = uuid4()
+        self.id = next(_planet_ids) if planet_id is None else planet_id
 
         self.planet_size = planet_size
         self.home_player = home_player
@@ -180,21 +337,27 @@ class Planet(object):
 
         self.scheduler = scheduler
 
-        # Should be last
-        self.planet_observable = BehaviorSubject(self)
+        # Created on the first subscription, most planets are never observed
+        self.planet_observable = None
 
     def set_owner(self: Self, player: Player) -> None:
         """
         Set the owner of the planet.
         """
         self.owner = player
-        self.planet_observable.on_next(self)
+        if self.planet_observable is not None:
+            self.planet_observable.on_next(self)
 
     def subscribe(self: Self, observer: any) -> None:
         """
         Subscribe to events of the planet.  The observer can be either an Observer or a function.
         It will be called and passed the planet object whenever the planet changes states.
         """
+        from reactivex import Observer
+        from reactivex.subject import BehaviorSubject
+
+        if self.planet_observable is None:
+            self.planet_observable = BehaviorSubject(self)
 
         if isinstance(observer, Observer):
             self.planet_observable.subscribe(observer, scheduler=self.scheduler)
@@ -207,7 +370,9 @@ class Planet(object):
 class Planets(object):
     """
     A class for creating and keeping track of all the planets in the game.  This is intended to be
-    the core state machine for the game.
+    the core state machine for the game.  The players are kept in a random order, the list
+    passed in is not modified.  max_attempts caps the random tries per planet and defaults
+    to MAX_PLACEMENT_ATTEMPTS.
     """
 
     def __init__(
@@ -216,36 +381,58 @@ class Planets(object):
         players: list[Player],
         number_of_planets: int = 10,
         min_distance: int = 5,
-        scheduler: abc.SchedulerBase = None,
+        scheduler: "abc.SchedulerBase" = None,
+        max_attempts: Optional[int] = None,
     ):
+        # Home planets are always medium, the rest can be any size
+        check_planet_count(
+            tableau,
+            min_distance,
+            [(len(players), PlanetSize.MEDIUM), (number_of_planets, _ALL_SIZES)],
+        )
+
         self.tableau = tableau
-        self.players = players.copy()
+        self.players = random.sample(players, len(players))
         self.min_distance = min_distance
         self.player_planet_list = []
         self.planet_list = []
+        self._all_planets = []
         self.all_planet_dict = {}
         self.scheduler = scheduler
-
-        random.shuffle(self.players)
-
-        # Create home planets for each player
-        for player in self.players:
-            player_planet = self.create_planet(
-                planet_size=PlanetSize.MEDIUM, home_player=player
-            )
-            self.player_planet_list.append(player_planet)
-
-        # Create the rest of the planets
-        for i in range(number_of_planets):
-            self.planet_list.append(self.create_planet())
+        self.max_attempts = max_attempts
+        self._grid = CollisionGrid(min_distance)
+
+        # Created on the first subscribe_changes call
+        self.changes_observable = None
+
+        # Creating a home planet sets it on the player, so remember the old ones in
+        # case placement fails and the players have to be left as they were
+        previous_home_planets = [player.home_planet for player in self.players]
+
+        try:
+            # Create home planets for each player
+            for player in self.players:
+                player_planet = self.create_planet(
+                    planet_size=PlanetSize.MEDIUM, home_player=player
+                )
+                self.player_planet_list.append(player_planet)
+
+            # Create the rest of the planets
+            for i in range(number_of_planets):
+                self.planet_list.append(self.create_planet())
+        except Exception:
+            for player, home_planet in zip(self.players, previous_home_planets):
+                player.home_planet = home_planet
+            raise
 
     def get_all_planets(self: Self) -> list[Planet]:
         """
-        Return a list of all the planets in the game.
+        Return a list of all the planets in the game.  The list is shared with the game
+        and should not be modified.
         """
-        return self.player_planet_list + self.planet_list
+        return self._all_planets
 
-    def get_planet_by_id(self: Self, planet_id: uuid4) -> Planet:
+    def get_planet_by_id(self: Self, planet_id: int) -> Planet:
         """
         Return the planet with the given planet's id.
         """
@@ -253,7 +440,7 @@ class Planets(object):
 
     def create_planet(
         self: Self,
-        planet_size: PlanetSize | list[PlanetSize] = list(PlanetSize),
+        planet_size: PlanetSize | Sequence[PlanetSize] = _ALL_SIZES,
         home_player: Optional[Player] = None,
     ) -> None:
         """
@@ -263,14 +450,60 @@ class Planets(object):
             self.tableau,
             min_distance=self.min_distance,
             planet_size=planet_size,
-            collision_list=self.get_all_planets(),
+            grid=self._grid,
             home_player=home_player,
             scheduler=self.scheduler,
+            max_attempts=self.max_attempts,
         )
+        self._grid.insert(planet.coordinate.x, planet.coordinate.y)
+        self._all_planets.append(planet)
         self.all_planet_dict[planet.id] = planet
 
         return planet
 
+    def batch_set_owners(self: Self, pairs: list[tuple[Planet, Player]]) -> None:
+        """
+        Set the owners of several planets at once.  All owners are updated before any
+        notifications are sent.  Only planets whose owner differs from the one before the
+        batch count as changed.  Each changed planet then notifies its own subscribers
+        once, and subscribers of subscribe_changes receive a single list of the changed
+        planets.
+        """
+        # Owner of each planet before the batch, in the order planets first appear
+        before = {}
+        for planet, player in pairs:
+            before.setdefault(planet, planet.owner)
+            planet.owner = player
+
+        changed = [
+            planet for planet, owner in before.items() if planet.owner is not owner
+        ]
+
+        for planet in changed:
+            if planet.planet_observable is not None:
+                planet.planet_observable.on_next(planet)
+
+        if self.changes_observable is not None and changed:
+            self.changes_observable.on_next(changed)
+
+    def subscribe_changes(self: Self, observer: any) -> None:
+        """
+        Subscribe to batched changes of the planets.  The observer can be either an Observer
+        or a function.  It will be called and passed a list of the changed planets every
+        time batch_set_owners is used.
+        """
+        from reactivex import Observer, Subject
+
+        if self.changes_observable is None:
+            self.changes_observable = Subject()
+
+        if isinstance(observer, Observer):
+            self.changes_observable.subscribe(observer, scheduler=self.scheduler)
+        else:
+            self.changes_observable.subscribe(
+                Observer(observer), scheduler=self.scheduler
+            )
+
 
 if __name__ == "__main__":
     tableau = Tableau(Coordinate(150, 150))
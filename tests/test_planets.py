@@ -0,0 +1,83 @@
+import unittest
+
+import planets.planets
+from planets import Coordinate, PlacementFailure, Planets, Player, Tableau
+
+RED = (255, 0, 0)
+BLUE = (0, 0, 255)
+
+
+class PlanetCountTest(unittest.TestCase):
+    def test_players_only_on_board_narrower_than_large_planet(self):
+        # Home planets are medium, so they fit even though a large planet wouldn't
+        tableau = Tableau(Coordinate(90, 900))
+        players = [Player("Aaron", RED), Player("Peter", BLUE)]
+
+        p = Planets(tableau, players, 0)
+
+        self.assertEqual(len(p.player_planet_list), 2)
+        for planet in p.player_planet_list:
+            self.assertTrue(37 <= planet.coordinate.x <= 53)
+
+    def test_other_planets_on_board_narrower_than_large_planet(self):
+        tableau = Tableau(Coordinate(90, 900))
+
+        with self.assertRaises(ValueError):
+            Planets(tableau, [Player("Aaron", RED)], 1)
+
+    def test_too_many_planets(self):
+        with self.assertRaises(ValueError):
+            Planets(Tableau(Coordinate(200, 200)), [], 57, 20)
+
+
+class MaxAttemptsTest(unittest.TestCase):
+    def test_max_attempts_argument(self):
+        with self.assertRaises(PlacementFailure):
+            Planets(Tableau(Coordinate(900, 900)), [], 1, max_attempts=0)
+
+    def test_module_constant_read_at_call_time(self):
+        default = planets.planets.MAX_PLACEMENT_ATTEMPTS
+        planets.planets.MAX_PLACEMENT_ATTEMPTS = 0
+        try:
+            with self.assertRaises(PlacementFailure):
+                Planets(Tableau(Coordinate(900, 900)), [], 1)
+        finally:
+            planets.planets.MAX_PLACEMENT_ATTEMPTS = default
+
+
+class BatchSetOwnersTest(unittest.TestCase):
+    def setUp(self):
+        self.players = [Player("Aaron", RED), Player("Peter", BLUE)]
+        self.p = Planets(Tableau(Coordinate(900, 900)), [], 2)
+        self.planet, self.other = self.p.planet_list
+
+        self.notified = []
+        self.batches = []
+        self.planet.subscribe(self.notified.append)
+        self.p.subscribe_changes(self.batches.append)
+        # Drop the current value sent on subscribe
+        self.notified.clear()
+
+    def test_owner_changed_and_restored_in_one_batch(self):
+        self.p.batch_set_owners([(self.planet, self.players[0]), (self.planet, None)])
+
+        self.assertIsNone(self.planet.owner)
+        self.assertEqual(self.notified, [])
+        self.assertEqual(self.batches, [])
+
+    def test_changed_planets_reported_once(self):
+        self.p.batch_set_owners(
+            [
+                (self.planet, self.players[0]),
+                (self.other, self.players[1]),
+                (self.planet, self.players[1]),
+            ]
+        )
+
+        self.assertIs(self.planet.owner, self.players[1])
+        self.assertEqual(self.notified, [self.planet])
+        self.assertEqual(self.batches, [[self.planet, self.other]])
+
+
+if __name__ == "__main__":
+    unittest.main()